@@ -4,16 +4,22 @@ Search API for Meilisearch filesystem indexer.
 Provides REST endpoints for searching indexed files.
 """
 
+import asyncio
+import hmac
 import os
 import re
 import time
-from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 import requests
-from fastapi import FastAPI, HTTPException, Query
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # Configuration
@@ -21,11 +27,21 @@ MEILISEARCH_URL = os.environ.get("MEILISEARCH_URL", "http://meilisearch:7700")
 MEILI_MASTER_KEY = os.environ.get("MEILI_MASTER_KEY", "")
 DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", "50"))
 MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "500"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "64"))
+CACHE_TTL_SEC = int(os.environ.get("CACHE_TTL_SEC", "15"))
+# Shared with the indexer; /internal/invalidate is disabled when unset
+CACHE_INVALIDATE_TOKEN = os.environ.get("CACHE_INVALIDATE_TOKEN", "")
+
+# Meilisearch endpoints (built once, reused on every request)
+HEALTH_URL = f"{MEILISEARCH_URL}/health"
+SEARCH_URL = f"{MEILISEARCH_URL}/indexes/files/search"
+STATS_URL = f"{MEILISEARCH_URL}/indexes/files/stats"
 
 app = FastAPI(
     title="Filesystem Search API",
     description="Search indexed files with Meilisearch",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Enable CORS
@@ -37,12 +53,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Meilisearch client session
+# Meilisearch client session; pooled keep-alive connections are reused across requests
 meili_session = requests.Session()
+_meili_adapter = HTTPAdapter(
+    pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0
+)
+meili_session.mount("http://", _meili_adapter)
+meili_session.mount("https://", _meili_adapter)
 if MEILI_MASTER_KEY:
     meili_session.headers["Authorization"] = f"Bearer {MEILI_MASTER_KEY}"
 meili_session.headers["Content-Type"] = "application/json"
 
+# Index-wide aggregates change only when a scan runs, so /stats and /suggest
+# are served from a short-lived cache keyed by endpoint name
+response_cache: TTLCache = TTLCache(maxsize=4, ttl=CACHE_TTL_SEC)
+CACHED_PATHS = frozenset({"/stats", "/suggest"})
+
+
+@app.middleware("http")
+async def add_cache_headers(request: Request, call_next):
+    """Let clients and intermediaries cache the slowly-changing aggregates."""
+    response = await call_next(request)
+    if request.url.path in CACHED_PATHS and response.status_code == 200:
+        response.headers["Cache-Control"] = f"public, max-age={CACHE_TTL_SEC}"
+    return response
+
 
 class SearchMode(str, Enum):
     """Search modes supported by the API."""
@@ -63,6 +98,22 @@ class SortOrder(str, Enum):
     PATH_DESC = "path_desc"
 
 
+# Words extracted from a regex query to seed the broad Meilisearch search
+REGEX_KEYWORD_RE = re.compile(r"\w+")
+
+# Document fields used to build FileResult rows; anything else is dropped
+RESULT_ATTRIBUTES = ["path", "basename", "ext", "dirpath", "size", "mtime"]
+
+SORT_MAP = {
+    SortOrder.MTIME_DESC: ["mtime:desc"],
+    SortOrder.MTIME_ASC: ["mtime:asc"],
+    SortOrder.SIZE_DESC: ["size:desc"],
+    SortOrder.SIZE_ASC: ["size:asc"],
+    SortOrder.PATH_ASC: ["path:asc"],
+    SortOrder.PATH_DESC: ["path:desc"],
+}
+
+
 class FileResult(BaseModel):
     """Single file search result."""
 
@@ -72,8 +123,8 @@ class FileResult(BaseModel):
     dirpath: str
     size: int
     mtime: int
-    mtime_formatted: str
-    size_formatted: str
+    mtime_formatted: Optional[str] = None
+    size_formatted: Optional[str] = None
 
 
 class SearchResponse(BaseModel):
@@ -98,18 +149,19 @@ class StatsResponse(BaseModel):
     field_distribution: Dict[str, int]
 
 
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
+
 def format_size(size: int) -> str:
     """Format file size in human-readable format."""
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if size < 1024.0:
-            return f"{size:.1f} {unit}"
-        size /= 1024.0
-    return f"{size:.1f} PB"
+    # Each unit is 2**10 of the previous one, so the bit length picks it directly
+    unit = min((size.bit_length() - 1) // 10, len(SIZE_UNITS) - 1) if size > 0 else 0
+    return f"{size / (1 << (unit * 10)):.1f} {SIZE_UNITS[unit]}"
 
 
 def format_timestamp(ts: int) -> str:
     """Format Unix timestamp to human-readable date."""
-    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
 
 
 def apply_regex_filter(
@@ -124,13 +176,56 @@ def apply_regex_filter(
         return []
 
 
+def quote_filter_value(value: str) -> str:
+    """Quote a user-supplied value for a Meilisearch filter expression."""
+    # Backslashes first, so a trailing backslash cannot escape the closing quote
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+@lru_cache(maxsize=256)
+def ext_filter(exts: Tuple[str, ...]) -> str:
+    """Build the extension filter clause; the UI reuses a handful of combinations."""
+    # Multiple extensions with OR
+    ext_filters = [f"ext = {quote_filter_value(e)}" for e in exts]
+    if len(ext_filters) > 1:
+        return f"({' OR '.join(ext_filters)})"
+    return ext_filters[0]
+
+
+def meili_get(url: str) -> Dict:
+    """GET a Meilisearch endpoint and return the decoded JSON body."""
+    response = meili_session.get(url)
+    response.raise_for_status()
+    return response.json()
+
+
+def meili_search(params: Dict) -> Dict:
+    """Run a search against the files index and return the decoded JSON body."""
+    response = meili_session.post(SEARCH_URL, json=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_last_scan() -> Optional[int]:
+    """Get the most recent seen_at value, used as the last scan time.
+
+    seen_at is filterable (the deletion sweep depends on it), so facetStats
+    yields its maximum in one search without needing it to be sortable.
+    """
+    try:
+        result = meili_search({"q": "", "limit": 0, "facets": ["seen_at"]})
+    except requests.RequestException:
+        return None
+
+    seen_at = result.get("facetStats", {}).get("seen_at")
+    return int(seen_at["max"]) if seen_at else None
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     try:
-        response = meili_session.get(f"{MEILISEARCH_URL}/health")
-        response.raise_for_status()
-        health = response.json()
+        health = await run_in_threadpool(meili_get, HEALTH_URL)
         return {"status": "healthy", "meilisearch": health.get("status")}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Service unhealthy: {e}")
@@ -155,6 +250,9 @@ async def search_files(
     per_page: int = Query(
         DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Results per page"
     ),
+    format: bool = Query(
+        False, description="Include human-readable size and mtime strings"
+    ),
 ):
     """Search indexed files with various filters and modes."""
 
@@ -167,6 +265,7 @@ async def search_files(
         ),  # Get more for regex filtering
         "offset": (page - 1) * per_page if mode != SearchMode.REGEX else 0,
         "showMatchesPosition": False,
+        "attributesToRetrieve": RESULT_ATTRIBUTES,
     }
 
     # Set query based on mode
@@ -174,7 +273,7 @@ async def search_files(
         if mode == SearchMode.REGEX:
             # For regex, we do a broad search and filter later
             # Extract potential keywords from the regex pattern
-            keywords = re.findall(r"\w+", q)
+            keywords = REGEX_KEYWORD_RE.findall(q)
             search_params["q"] = " ".join(keywords) if keywords else ""
         else:
             # For PLAIN and SUBSTR, Meilisearch handles it naturally
@@ -186,19 +285,12 @@ async def search_files(
     filters = []
 
     if ext:
-        # Multiple extensions with OR
-        ext_filters = [f'ext = "{e}"' for e in ext]
-        if len(ext_filters) > 1:
-            filters.append(f"({' OR '.join(ext_filters)})")
-        else:
-            filters.append(ext_filters[0])
+        filters.append(ext_filter(tuple(ext)))
 
     if dir:
-        # Directory prefix - escape quotes in dir path
-        escaped_dir = dir.replace('"', '\\"')
         # Meilisearch doesn't support LIKE, so we'll need to post-filter
         # For now, we can filter by exact dirpath
-        filters.append(f'dirpath = "{escaped_dir}"')
+        filters.append(f"dirpath = {quote_filter_value(dir)}")
 
     if mtime_from:
         filters.append(f"mtime >= {mtime_from}")
@@ -214,23 +306,11 @@ async def search_files(
         search_params["filter"] = " AND ".join(filters)
 
     # Set sort order
-    sort_map = {
-        SortOrder.MTIME_DESC: ["mtime:desc"],
-        SortOrder.MTIME_ASC: ["mtime:asc"],
-        SortOrder.SIZE_DESC: ["size:desc"],
-        SortOrder.SIZE_ASC: ["size:asc"],
-        SortOrder.PATH_ASC: ["path:asc"],
-        SortOrder.PATH_DESC: ["path:desc"],
-    }
-    search_params["sort"] = sort_map[sort]
+    search_params["sort"] = SORT_MAP[sort]
 
     # Execute search
     try:
-        response = meili_session.post(
-            f"{MEILISEARCH_URL}/indexes/files/search", json=search_params
-        )
-        response.raise_for_status()
-        search_result = response.json()
+        search_result = await run_in_threadpool(meili_search, search_params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {e}")
 
@@ -248,21 +328,23 @@ async def search_files(
     else:
         total = search_result.get("estimatedTotalHits", 0)
 
-    # Format results
+    # Format results as plain dicts: the hits come straight from our own index,
+    # so per-row Pydantic validation would only re-check trusted values
     results = []
     for hit in hits:
-        results.append(
-            FileResult(
-                path=hit.get("path", ""),
-                basename=hit.get("basename", ""),
-                ext=hit.get("ext", ""),
-                dirpath=hit.get("dirpath", ""),
-                size=hit.get("size", 0),
-                mtime=hit.get("mtime", 0),
-                mtime_formatted=format_timestamp(hit.get("mtime", 0)),
-                size_formatted=format_size(hit.get("size", 0)),
-            )
-        )
+        row = {
+            "path": hit.get("path", ""),
+            "basename": hit.get("basename", ""),
+            "ext": hit.get("ext", ""),
+            "dirpath": hit.get("dirpath", ""),
+            "size": hit.get("size", 0),
+            "mtime": hit.get("mtime", 0),
+        }
+        # Display strings are opt-in; clients can format the raw values locally
+        if format:
+            row["mtime_formatted"] = format_timestamp(row["mtime"])
+            row["size_formatted"] = format_size(row["size"])
+        results.append(row)
 
     # Calculate total pages
     total_pages = (total + per_page - 1) // per_page if total > 0 else 0
@@ -270,56 +352,46 @@ async def search_files(
     # Calculate response time
     took_ms = int((time.time() - start_time) * 1000)
 
-    return SearchResponse(
-        query=q or "",
-        mode=mode,
-        total=total,
-        page=page,
-        per_page=per_page,
-        total_pages=total_pages,
-        results=results,
-        took_ms=took_ms,
+    # Returned directly so FastAPI skips response_model validation; the model
+    # still documents the schema
+    return ORJSONResponse(
+        {
+            "query": q or "",
+            "mode": mode.value,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": total_pages,
+            "results": results,
+            "took_ms": took_ms,
+        }
     )
 
 
 @app.get("/stats", response_model=StatsResponse)
 async def get_stats():
     """Get index statistics."""
+    cached = response_cache.get("stats")
+    if cached is not None:
+        return ORJSONResponse(cached)
+
     try:
-        response = meili_session.get(f"{MEILISEARCH_URL}/indexes/files/stats")
-        response.raise_for_status()
-        stats = response.json()
-
-        # Get the most recent seen_at value for last scan time
-        try:
-            search_response = meili_session.post(
-                f"{MEILISEARCH_URL}/indexes/files/search",
-                json={"q": "", "limit": 1, "sort": ["seen_at:desc"]},
-            )
-            search_response.raise_for_status()
-            search_data = search_response.json()
-        except requests.RequestException:
-            # Fallback: try without sort (schema may not mark seen_at as sortable yet)
-            try:
-                fallback = meili_session.post(
-                    f"{MEILISEARCH_URL}/indexes/files/search",
-                    json={"q": "", "limit": 1},
-                )
-                fallback.raise_for_status()
-                search_data = fallback.json()
-            except requests.RequestException:
-                search_data = {"hits": []}
-
-        last_scan = None
-        if search_data.get("hits"):
-            last_scan = search_data["hits"][0].get("seen_at")
-
-        return StatsResponse(
-            total_files=stats.get("numberOfDocuments", 0),
-            is_indexing=stats.get("isIndexing", False),
-            last_scan=last_scan,
-            field_distribution=stats.get("fieldDistribution", {}),
+        # Index stats and the last-scan lookup are independent; fetch them concurrently
+        stats, last_scan = await asyncio.gather(
+            run_in_threadpool(meili_get, STATS_URL),
+            run_in_threadpool(fetch_last_scan),
         )
+
+        # Meilisearch already returns these with the right types, so the
+        # payload skips response_model validation like /search does
+        result = {
+            "total_files": stats.get("numberOfDocuments", 0),
+            "is_indexing": stats.get("isIndexing", False),
+            "last_scan": last_scan,
+            "field_distribution": stats.get("fieldDistribution", {}),
+        }
+        response_cache["stats"] = result
+        return ORJSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get stats: {e}")
 
@@ -327,14 +399,15 @@ async def get_stats():
 @app.get("/suggest")
 async def suggest_extensions():
     """Get list of available file extensions for filtering."""
+    cached = response_cache.get("suggest")
+    if cached is not None:
+        return ORJSONResponse(cached)
+
     try:
         # Use facets to get extension distribution
-        response = meili_session.post(
-            f"{MEILISEARCH_URL}/indexes/files/search",
-            json={"q": "", "limit": 0, "facets": ["ext"]},
+        result = await run_in_threadpool(
+            meili_search, {"q": "", "limit": 0, "facets": ["ext"]}
         )
-        response.raise_for_status()
-        result = response.json()
 
         facet_dist = result.get("facetDistribution", {}).get("ext", {})
 
@@ -348,7 +421,9 @@ async def suggest_extensions():
             :100
         ]  # Limit to top 100
 
-        return {"extensions": extensions}
+        suggestions = {"extensions": extensions}
+        response_cache["suggest"] = suggestions
+        return ORJSONResponse(suggestions)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get suggestions: {e}")
@@ -362,7 +437,34 @@ async def trigger_reindex():
     return {"message": "Reindex triggered", "status": "pending"}
 
 
+@app.post("/internal/invalidate")
+async def invalidate_cache(x_invalidate_token: str = Header("")):
+    """
+    Drop cached aggregates; called by the indexer when a scan completes.
+    Requires the X-Invalidate-Token header to match CACHE_INVALIDATE_TOKEN,
+    and is refused outright when no token is configured. The cache lives in
+    each worker process, so with WEB_CONCURRENCY > 1 only the worker that
+    receives the request is cleared; the others catch up within
+    CACHE_TTL_SEC.
+    """
+    if not CACHE_INVALIDATE_TOKEN or not hmac.compare_digest(
+        x_invalidate_token.encode(), CACHE_INVALIDATE_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid invalidation token")
+    response_cache.clear()
+    return {"status": "ok"}
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8080,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "2")),
+        backlog=2048,
+        access_log=False,
+    )
@@ -4,15 +4,24 @@ import os
 import sys
 from unittest.mock import Mock, patch
 
+import pytest
 from fastapi.testclient import TestClient
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from main import app, SearchMode
+from main import app, response_cache, SearchMode
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Keep cached /stats and /suggest responses from leaking between tests."""
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
 class TestSearchAPI:
     """Test cases for Search API endpoints."""
 
@@ -68,6 +77,10 @@ class TestSearchAPI:
         assert data["total"] == 1
         assert len(data["results"]) == 1
         assert data["results"][0]["basename"] == "file.txt"
+        assert "size_formatted" not in data["results"][0]
+
+        response = client.get("/search?q=test&format=1")
+        assert response.json()["results"][0]["size_formatted"] == "1.0 KB"
 
     @patch("main.meili_session.post")
     def test_search_with_filters(self, mock_post):
@@ -167,6 +180,7 @@ class TestSearchAPI:
         call_args = mock_post.call_args
         search_params = call_args[1]["json"]
         assert search_params["offset"] == 5  # (page 2 - 1) * 5
+        assert "uid" not in search_params["attributesToRetrieve"]
 
     @patch("main.meili_session.post")
     def test_search_sorting(self, mock_post):
@@ -207,7 +221,10 @@ class TestSearchAPI:
 
         # Mock search for last scan
         mock_post_response = Mock()
-        mock_post_response.json.return_value = {"hits": [{"seen_at": 1700000000}]}
+        mock_post_response.json.return_value = {
+            "hits": [],
+            "facetStats": {"seen_at": {"min": 1690000000, "max": 1700000000}},
+        }
         mock_post_response.raise_for_status = Mock()
         mock_post.return_value = mock_post_response
 
@@ -239,6 +256,37 @@ class TestSearchAPI:
         assert extensions[0]["ext"] == "txt"
         assert extensions[0]["count"] == 500
 
+    @patch("main.CACHE_INVALIDATE_TOKEN", "secret")
+    @patch("main.meili_session.post")
+    def test_suggest_extensions_cached(self, mock_post):
+        """Test that suggestions are cached until invalidated."""
+        mock_response = Mock()
+        mock_response.json.return_value = {"facetDistribution": {"ext": {"txt": 5}}}
+        mock_response.raise_for_status = Mock()
+        mock_post.return_value = mock_response
+
+        first = client.get("/suggest")
+        second = client.get("/suggest")
+        assert first.json() == second.json()
+        assert mock_post.call_count == 1
+        assert second.headers["Cache-Control"].startswith("public, max-age=")
+
+        response = client.post(
+            "/internal/invalidate", headers={"X-Invalidate-Token": "secret"}
+        )
+        assert response.status_code == 200
+        client.get("/suggest")
+        assert mock_post.call_count == 2
+
+    @pytest.mark.parametrize("configured", ["", "secret"])
+    @pytest.mark.parametrize("sent", [None, "", "wrong"])
+    def test_invalidate_requires_token(self, configured, sent):
+        """Test that the cache cannot be flushed without the shared token."""
+        headers = {} if sent is None else {"X-Invalidate-Token": sent}
+        with patch("main.CACHE_INVALIDATE_TOKEN", configured):
+            response = client.post("/internal/invalidate", headers=headers)
+        assert response.status_code == 403
+
     def test_search_invalid_page(self):
         """Test search with invalid page number."""
         response = client.get("/search?page=0")
@@ -308,6 +356,40 @@ class TestSearchAPI:
         assert "ext = " in filter_str
         assert "OR" in filter_str
 
+    @patch("main.meili_session.post")
+    def test_search_filter_values_are_quoted(self, mock_post):
+        """Test that quotes in filter values cannot break out of the filter."""
+        mock_response = Mock()
+        mock_response.json.return_value = {"hits": [], "estimatedTotalHits": 0}
+        mock_response.raise_for_status = Mock()
+        mock_post.return_value = mock_response
+
+        response = client.get('/search?ext=txt" OR ext = "pdf&dir=/a"b')
+        assert response.status_code == 200
+
+        filter_str = mock_post.call_args[1]["json"]["filter"]
+        assert 'ext = "txt\\" OR ext = \\"pdf"' in filter_str
+        assert 'dirpath = "/a\\"b"' in filter_str
+
+    @patch("main.meili_session.post")
+    def test_search_filter_backslashes_are_escaped(self, mock_post):
+        """Test that backslashes in filter values cannot escape the closing quote."""
+        mock_response = Mock()
+        mock_response.json.return_value = {"hits": [], "estimatedTotalHits": 0}
+        mock_response.raise_for_status = Mock()
+        mock_post.return_value = mock_response
+
+        response = client.get("/search", params={"dir": "/a\\", "ext": "t\\x"})
+        assert response.status_code == 200
+        filter_str = mock_post.call_args[1]["json"]["filter"]
+        assert 'dirpath = "/a\\\\"' in filter_str
+        assert 'ext = "t\\\\x"' in filter_str
+
+        response = client.get("/search", params={"dir": '/a\\" OR root = "x'})
+        assert response.status_code == 200
+        filter_str = mock_post.call_args[1]["json"]["filter"]
+        assert 'dirpath = "/a\\\\\\" OR root = \\"x"' in filter_str
+
     @patch("main.meili_session.post")
     def test_search_error_handling(self, mock_post):
         """Test search error handling."""
@@ -318,9 +400,11 @@ class TestSearchAPI:
         assert "Search failed" in response.json()["detail"]
 
     @patch("main.meili_session.get")
-    def test_stats_error_handling(self, mock_get):
+    @patch("main.meili_session.post")
+    def test_stats_error_handling(self, mock_post, mock_get):
         """Test stats endpoint error handling."""
         mock_get.side_effect = Exception("Connection error")
+        mock_post.return_value = Mock(json=Mock(return_value={"facetStats": {}}))
 
         response = client.get("/stats")
         assert response.status_code == 500
@@ -6,13 +6,22 @@ Scans directories, extracts metadata, and indexes files.
 
 import fnmatch
 import os
+import queue
+import re
+import struct
 import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Iterator, List, Dict, Any
+from itertools import islice
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 
+import orjson
 import requests
 import structlog
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xxhash
 from tenacity import retry, stop_after_attempt, wait_exponential
 
@@ -35,6 +44,41 @@ structlog.configure(
 
 logger = structlog.get_logger()
 
+# (dev, ino) packed as two unsigned 64-bit ints for file ID hashing
+pack_dev_ino = struct.Struct("<QQ").pack
+
+# Default directory listing threads; traversal is bound by stat/readdir latency
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate an exclusion glob into an unanchored regex.
+    "**/" matches zero or more leading directories and a trailing "/**"
+    matches everything below the directory, so "build/**" matches the
+    directory "build/" but not a file named "build".
+    """
+    tail = ""
+    if pattern.endswith("/**"):
+        pattern, tail = pattern[:-3], "/(?s:.*)"
+    # fnmatch.translate() ends each piece with a \Z anchor; strip it so the
+    # pieces can be joined and the union can stop on a parent prefix
+    parts = [fnmatch.translate(part)[:-2] for part in pattern.split("**/")]
+    return "(?s:.*/)?".join(parts) + tail
+
+
+def compile_excludes(patterns: List[str]) -> Optional[re.Pattern]:
+    """
+    Compile exclusion globs into a single regex.
+    A path is excluded when any pattern matches the whole path or one of its
+    parent directory prefixes ("a/", "a/b/", ...). Directories are checked
+    with a trailing "/", which patterns for the bare name also match.
+    """
+    if not patterns:
+        return None
+    union = "|".join(f"(?:{glob_to_regex(p)})" for p in patterns)
+    return re.compile(f"(?:{union})(?:/?\\Z|(?<=/))")
+
 
 @dataclass
 class Config:
@@ -48,6 +92,10 @@ class Config:
     stability_sec: int
     batch_size: int
     log_level: str
+    search_api_url: str = ""
+    invalidate_token: str = ""
+    upload_workers: int = 4
+    scan_threads: int = 0
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -65,26 +113,56 @@ class Config:
             stability_sec=int(os.environ.get("STABILITY_SEC", "30")),
             batch_size=int(os.environ.get("BATCH_SIZE", "10000")),
             log_level=os.environ.get("LOG_LEVEL", "INFO"),
+            search_api_url=os.environ.get("SEARCH_API_URL", ""),
+            invalidate_token=os.environ.get("CACHE_INVALIDATE_TOKEN", ""),
+            upload_workers=int(os.environ.get("UPLOAD_WORKERS", "4")),
+            scan_threads=int(os.environ.get("SCAN_THREADS", "0")),
         )
 
 
 class MeilisearchClient:
     """Simple Meilisearch client for file indexing."""
 
-    def __init__(self, url: str, master_key: str = ""):
+    def __init__(self, url: str, master_key: str = "", pool_size: int = 8):
         self.url = url
         self.session = requests.Session()
+        # Reuse keep-alive connections for batch uploads and task polling. A
+        # pooled socket the server has since closed is retried at once rather
+        # than through the slower tenacity backoff; every call here is safe to
+        # repeat (upserts by id, deletes by filter, searches and reads).
+        # These retries stack under the tenacity decorators: one batch can be
+        # sent up to 3 x (1 + 3) = 12 times before add_documents gives up
+        retries = Retry(
+            total=3,
+            connect=3,
+            read=2,
+            status=0,
+            backoff_factor=0.2,
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retries
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         if master_key:
             self.session.headers["Authorization"] = f"Bearer {master_key}"
         self.session.headers["Content-Type"] = "application/json"
         self.index_name = "files"
+        # Endpoint URLs are fixed for the client's lifetime
+        index_url = f"{url}/indexes/{self.index_name}"
+        self.documents_url = f"{index_url}/documents"
+        self.delete_url = f"{index_url}/documents/delete"
+        self.search_url = f"{index_url}/search"
+        self.stats_url = f"{index_url}/stats"
 
     def wait_for_task(self, task_uid: int, timeout: int = 300) -> bool:
         """Wait for a task to complete."""
+        task_url = f"{self.url}/tasks/{task_uid}"
         start = time.time()
         while time.time() - start < timeout:
             try:
-                response = self.session.get(f"{self.url}/tasks/{task_uid}")
+                response = self.session.get(task_url)
                 response.raise_for_status()
                 task = response.json()
 
@@ -110,8 +188,10 @@ class MeilisearchClient:
     )
     def add_documents(self, documents: List[Dict[str, Any]], wait: bool = False) -> int:
         """Add or update documents in the index."""
+        # orjson encodes large batches several times faster than stdlib json
         response = self.session.post(
-            f"{self.url}/indexes/{self.index_name}/documents", json=documents
+            self.documents_url,
+            data=orjson.dumps(documents),
         )
         response.raise_for_status()
 
@@ -128,8 +208,8 @@ class MeilisearchClient:
     def delete_documents(self, filter: str, wait: bool = False) -> int:
         """Delete documents matching a filter."""
         response = self.session.post(
-            f"{self.url}/indexes/{self.index_name}/documents/delete",
-            json={"filter": filter},
+            self.delete_url,
+            data=orjson.dumps({"filter": filter}),
         )
         response.raise_for_status()
 
@@ -140,9 +220,34 @@ class MeilisearchClient:
 
         return task_uid
 
+    @retry(
+        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10)
+    )
+    def count_documents(self, filter: str) -> int:
+        """
+        Estimate how many documents match a filter without fetching any.
+        Meilisearch's estimatedTotalHits is approximate and capped at the
+        index's pagination.maxTotalHits, so only rely on it being non-zero.
+        """
+        response = self.session.post(
+            self.search_url,
+            data=orjson.dumps({"q": "", "limit": 0, "filter": filter}),
+        )
+        response.raise_for_status()
+        return response.json().get("estimatedTotalHits", 0)
+
+    @retry(
+        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10)
+    )
+    def get_task(self, task_uid: int) -> Dict[str, Any]:
+        """Get a task, including its details once it has finished."""
+        response = self.session.get(f"{self.url}/tasks/{task_uid}")
+        response.raise_for_status()
+        return response.json()
+
     def get_stats(self) -> Dict[str, Any]:
         """Get index statistics."""
-        response = self.session.get(f"{self.url}/indexes/{self.index_name}/stats")
+        response = self.session.get(self.stats_url)
         response.raise_for_status()
         return response.json()
 
@@ -151,9 +256,23 @@ class FileIndexer:
     """Main indexer class for scanning and indexing files."""
 
     def __init__(self, config: Config):
+        # ROOT_NAME is placed verbatim inside the deletion sweep's quoted
+        # filter value, so refuse the characters that would need escaping
+        if '"' in config.root_name or "\\" in config.root_name:
+            raise ValueError("ROOT_NAME must not contain double quotes or backslashes")
         self.config = config
-        self.client = MeilisearchClient(config.meilisearch_url, config.master_key)
+        # One keep-alive connection per upload worker, plus one for the scan
+        # thread's task polling and deletion sweep
+        self.client = MeilisearchClient(
+            config.meilisearch_url,
+            config.master_key,
+            pool_size=max(1, config.upload_workers) + 1,
+        )
         self.excludes = self._load_excludes()
+        # Per-root constants: every document shares one interned root string,
+        # and the deletion sweep's filter prefix is built only once
+        self._root_name = sys.intern(config.root_name)
+        self._root_filter = f'root = "{config.root_name}"'
         self.stats = {
             "files_scanned": 0,
             "files_indexed": 0,
@@ -163,130 +282,190 @@ class FileIndexer:
             "start_time": time.time(),
         }
         self.pending_tasks = []
+        # Upload workers update stats concurrently with the scanning thread
+        self._stats_lock = threading.Lock()
 
     def _load_excludes(self) -> List[str]:
         """Load exclusion patterns from file."""
-        excludes = []
         try:
-            if os.path.exists(self.config.excludes_file):
-                with open(self.config.excludes_file, "r") as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith("#"):
-                            excludes.append(line)
-                logger.info("loaded_excludes", count=len(excludes))
+            # Read the whole file at once and split it in C rather than
+            # iterating line by line; large gitignore-style lists are common
+            with open(self.config.excludes_file, "r", errors="replace") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
         except Exception as e:
             logger.error("failed_to_load_excludes", error=str(e))
+            return []
+
+        excludes = [
+            line for line in map(str.strip, lines) if line and not line.startswith("#")
+        ]
+        logger.info("loaded_excludes", count=len(excludes))
         return excludes
 
+    @property
+    def excludes(self) -> List[str]:
+        """Exclusion glob patterns."""
+        return self._excludes
+
+    @excludes.setter
+    def excludes(self, patterns: List[str]) -> None:
+        self._excludes = list(patterns)
+        self._exclude_re = compile_excludes(self._excludes)
+
     def _is_excluded(self, path: str) -> bool:
         """Check if path matches any exclusion pattern."""
-        for pattern in self.excludes:
-            if fnmatch.fnmatch(path, pattern):
-                return True
-            # Also check if any parent directory matches
-            parts = path.split("/")
-            for i in range(1, len(parts)):
-                partial = "/".join(parts[:i]) + "/"
-                if fnmatch.fnmatch(partial, pattern):
-                    return True
-        return False
+        return self._exclude_re is not None and bool(self._exclude_re.match(path))
 
     def _compute_file_id(self, dev: int, ino: int) -> int:
         """Compute unique file ID from device and inode."""
-        # Meilisearch needs positive integers for IDs
-        hash_val = xxhash.xxh64_intdigest(f"{dev}:{ino}")
+        # Meilisearch needs positive integers for IDs; hashing the packed
+        # bytes avoids formatting a string for every scanned file
+        hash_val = xxhash.xxh64_intdigest(pack_dev_ino(dev, ino))
         # Ensure it's positive and within JavaScript's safe integer range
         return hash_val & 0x7FFFFFFFFFFFFFFF
 
     def _scan_directory(self, root_dir: str, scan_id: int) -> Iterator[Dict[str, Any]]:
         """
         Recursively scan directory and yield file documents.
-        Uses iterative approach with stack to avoid deep recursion.
+        Directories are listed concurrently by a thread pool, since scandir and
+        stat release the GIL; only a few directories per worker are in flight
+        at once so memory stays bounded on huge trees.
         """
         if not os.path.exists(root_dir):
             logger.error("root_dir_not_found", path=root_dir)
             return
 
-        stack = [root_dir]
-        now = time.time()
+        # Files modified after this point are still inside the stability
+        # window; the clock is read once per scan rather than once per file
+        mtime_cutoff = time.time() - self.config.stability_sec
+        # Paths under root_dir are sliced instead of going through os.path.relpath
+        prefix_len = len(os.path.join(root_dir, ""))
+        pending = [root_dir]
+        in_flight = set()
+        # 0 (the default) sizes the pool from the CPU count
+        workers = (
+            self.config.scan_threads if self.config.scan_threads > 0 else SCAN_WORKERS
+        )
+        max_in_flight = workers * 2
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    in_flight.add(
+                        executor.submit(
+                            self._scan_one_directory,
+                            pending.pop(),
+                            prefix_len,
+                            scan_id,
+                            mtime_cutoff,
+                        )
+                    )
 
-        while stack:
-            current_dir = stack.pop()
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    documents, subdirs, skipped, errors = future.result()
+                    pending.extend(subdirs)
+                    with self._stats_lock:
+                        self.stats["files_scanned"] += len(documents)
+                        self.stats["files_skipped"] += skipped
+                        self.stats["errors"] += errors
+                    yield from documents
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _scan_one_directory(
+        self, current_dir: str, prefix_len: int, scan_id: int, mtime_cutoff: float
+    ) -> Tuple[List[Dict[str, Any]], List[str], int, int]:
+        """
+        List a single directory on a scan worker thread.
+        Returns (documents, subdirectories, files skipped, errors) so that all
+        shared state is updated by the consuming thread. Excluded
+        subdirectories are dropped here so they are never listed.
+        """
+        documents = []
+        subdirs = []
+        skipped = 0
+        errors = 0
+        # Every file listed here shares the same parent; os.path.dirname of
+        # "<dir>/" normalizes trailing slashes the same way it would per file
+        dirpath = os.path.dirname(os.path.join(current_dir, ""))
+        # Bind per-file lookups to locals; this loop runs once per file scanned
+        is_excluded = self._is_excluded
+        compute_file_id = self._compute_file_id
+        root_name = self._root_name
+        add_document = documents.append
 
-            # Check if directory is excluded
-            rel_dir = os.path.relpath(current_dir, root_dir)
-            if rel_dir != "." and self._is_excluded(rel_dir):
-                logger.debug("excluded_dir", path=rel_dir)
-                continue
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    path = entry.path
+                    try:
+                        # Handle directories
+                        if entry.is_dir(follow_symlinks=False):
+                            rel_dir = path[prefix_len:] + "/"
+                            if is_excluded(rel_dir):
+                                logger.debug("excluded_dir", path=rel_dir)
+                            else:
+                                subdirs.append(path)
+                            continue
 
-            try:
-                with os.scandir(current_dir) as entries:
-                    for entry in entries:
-                        try:
-                            # Handle directories
-                            if entry.is_dir(follow_symlinks=False):
-                                stack.append(entry.path)
-                                continue
-
-                            # Handle files
-                            if not entry.is_file(follow_symlinks=False):
-                                continue
-
-                            # Check exclusions
-                            rel_path = os.path.relpath(entry.path, root_dir)
-                            if self._is_excluded(rel_path):
-                                self.stats["files_skipped"] += 1
-                                continue
-
-                            # Get file stats
-                            stat = entry.stat(follow_symlinks=False)
-
-                            # Skip recently modified files (stability window)
-                            if now - stat.st_mtime < self.config.stability_sec:
-                                logger.debug("skipped_recent_file", path=entry.path)
-                                self.stats["files_skipped"] += 1
-                                continue
-
-                            # Extract metadata
-                            doc_id = self._compute_file_id(stat.st_dev, stat.st_ino)
-                            basename = entry.name
-                            dirpath = os.path.dirname(entry.path)
-                            ext = (
-                                os.path.splitext(basename)[1][1:].lower()
-                                if "." in basename
-                                else ""
-                            )
-
-                            self.stats["files_scanned"] += 1
-
-                            # Yield document for Meilisearch
-                            yield {
-                                "id": doc_id,
-                                "root": self.config.root_name,
-                                "path": entry.path,
+                        # Handle files
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+
+                        # Check exclusions
+                        if is_excluded(path[prefix_len:]):
+                            skipped += 1
+                            continue
+
+                        # Get file stats
+                        stat = entry.stat(follow_symlinks=False)
+
+                        # Skip recently modified files (stability window)
+                        mtime = stat.st_mtime
+                        if mtime > mtime_cutoff:
+                            logger.debug("skipped_recent_file", path=path)
+                            skipped += 1
+                            continue
+
+                        # Extract metadata
+                        basename = entry.name
+                        # Same result as os.path.splitext: a leading run of
+                        # dots (".bashrc") does not start an extension
+                        stem, _, ext = basename.rpartition(".")
+                        ext = ext.lower() if stem.lstrip(".") else ""
+
+                        # Document for Meilisearch
+                        add_document(
+                            {
+                                "id": compute_file_id(stat.st_dev, stat.st_ino),
+                                "root": root_name,
+                                "path": path,
                                 "basename": basename,
                                 "ext": ext,
                                 "dirpath": dirpath,
                                 "size": stat.st_size,
-                                "mtime": int(stat.st_mtime),
+                                "mtime": int(mtime),
                                 "uid": stat.st_uid,
                                 "gid": stat.st_gid,
                                 "mode": stat.st_mode,
                                 "seen_at": scan_id,
                             }
+                        )
 
-                        except (OSError, IOError) as e:
-                            logger.warning(
-                                "file_stat_error", path=entry.path, error=str(e)
-                            )
-                            self.stats["errors"] += 1
-                            continue
+                    except (OSError, IOError) as e:
+                        logger.warning("file_stat_error", path=path, error=str(e))
+                        errors += 1
+                        continue
 
-            except (OSError, IOError) as e:
-                logger.error("dir_scan_error", path=current_dir, error=str(e))
-                self.stats["errors"] += 1
-                continue
+        except (OSError, IOError) as e:
+            logger.error("dir_scan_error", path=current_dir, error=str(e))
+            errors += 1
+
+        return documents, subdirs, skipped, errors
 
     def _index_batch(self, documents: List[Dict[str, Any]]) -> None:
         """Index a batch of documents."""
@@ -295,12 +474,22 @@ class FileIndexer:
 
         try:
             task_uid = self.client.add_documents(documents, wait=False)
-            self.pending_tasks.append(task_uid)
-            self.stats["files_indexed"] += len(documents)
+            with self._stats_lock:
+                self.pending_tasks.append(task_uid)
+                self.stats["files_indexed"] += len(documents)
             logger.info("batch_submitted", count=len(documents), task_uid=task_uid)
         except Exception as e:
             logger.error("batch_index_failed", error=str(e), count=len(documents))
-            self.stats["errors"] += 1
+            with self._stats_lock:
+                self.stats["errors"] += 1
+
+    def _upload_worker(self, batches: queue.Queue) -> None:
+        """Submit queued batches until a None sentinel is received."""
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            self._index_batch(batch)
 
     def _wait_for_pending_tasks(self) -> None:
         """Wait for all pending indexing tasks to complete."""
@@ -321,42 +510,87 @@ class FileIndexer:
         try:
             # Build filter for deletion
             # Meilisearch filter syntax: root = "value" AND seen_at < number
-            filter_str = f'root = "{self.config.root_name}" AND seen_at < {scan_id}'
+            filter_str = f"{self._root_filter} AND seen_at < {scan_id}"
 
-            logger.info("starting_deletion_sweep", filter=filter_str)
+            # Most rescans remove nothing; skip enqueueing (and waiting on) a
+            # delete task when no document is stale
+            stale = self.client.count_documents(filter_str)
+            if not stale:
+                logger.info("deletion_sweep_skipped", filter=filter_str)
+                return
 
-            task_uid = self.client.delete_documents(filter_str, wait=True)
+            logger.info("starting_deletion_sweep", filter=filter_str, stale=stale)
 
-            # Get stats to see how many were deleted
-            # Note: Meilisearch doesn't return deletion count directly
-            # You'd need to track this differently if exact count is needed
+            task_uid = self.client.delete_documents(filter_str, wait=True)
+            # The count above is only an estimate; the finished task reports
+            # how many documents were actually removed
+            details = self.client.get_task(task_uid).get("details") or {}
+            deleted = details.get("deletedDocuments") or 0
+            self.stats["files_deleted"] += deleted
 
-            logger.info("deletion_sweep_complete", task_uid=task_uid)
+            logger.info("deletion_sweep_complete", task_uid=task_uid, deleted=deleted)
 
         except Exception as e:
             logger.error("deletion_sweep_failed", error=str(e))
             self.stats["errors"] += 1
 
-    def run(self) -> None:
-        """Main indexing loop."""
-        scan_id = int(time.time())
-        logger.info("scan_started", scan_id=scan_id, roots=self.config.scan_roots)
+    def _invalidate_api_cache(self) -> None:
+        """Tell the search API to drop its cached aggregates after a scan."""
+        # The API refuses invalidation without the shared token
+        if not self.config.search_api_url or not self.config.invalidate_token:
+            return
 
-        batch = []
+        try:
+            # Not through self.client.session: that carries the Meilisearch
+            # master key and retries POSTs, neither of which the API should get
+            response = requests.post(
+                f"{self.config.search_api_url}/internal/invalidate",
+                headers={"X-Invalidate-Token": self.config.invalidate_token},
+                timeout=5,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("api_cache_invalidate_failed", error=str(e))
 
+    def _scan_roots(self, scan_id: int) -> Iterator[Dict[str, Any]]:
+        """Yield file documents from every configured scan root in turn."""
         for root_dir in self.config.scan_roots:
             logger.info("scanning_root", root=root_dir)
+            yield from self._scan_directory(root_dir, scan_id)
 
-            for document in self._scan_directory(root_dir, scan_id):
-                batch.append(document)
+    def run(self) -> None:
+        """Main indexing loop."""
+        scan_id = int(time.time())
+        logger.info("scan_started", scan_id=scan_id, roots=self.config.scan_roots)
 
-                if len(batch) >= self.config.batch_size:
-                    self._index_batch(batch)
-                    batch.clear()
+        # Batches are uploaded on background threads so scanning never waits
+        # on Meilisearch unless the queue fills up; allowing two waiting
+        # batches per worker keeps every worker busy while bounding memory
+        workers = max(1, self.config.upload_workers)
+        batches: queue.Queue = queue.Queue(maxsize=workers * 2)
+        uploaders = [
+            threading.Thread(
+                target=self._upload_worker, args=(batches,), name=f"upload-{i}"
+            )
+            for i in range(workers)
+        ]
+        for uploader in uploaders:
+            uploader.start()
 
-        # Index remaining files
-        if batch:
-            self._index_batch(batch)
+        try:
+            # Cut batches straight off the scan generator; at most one
+            # partially filled batch is held here at any time
+            documents = self._scan_roots(scan_id)
+            while True:
+                batch = list(islice(documents, self.config.batch_size))
+                if not batch:
+                    break
+                batches.put(batch)
+        finally:
+            for _ in uploaders:
+                batches.put(None)
+            for uploader in uploaders:
+                uploader.join()
 
         # Wait for all indexing tasks to complete
         self._wait_for_pending_tasks()
@@ -375,6 +609,8 @@ class FileIndexer:
         except Exception as e:
             logger.warning("failed_to_get_stats", error=str(e))
 
+        self._invalidate_api_cache()
+
         # Log statistics
         elapsed = time.time() - self.stats["start_time"]
         logger.info(
@@ -384,6 +620,7 @@ class FileIndexer:
             files_scanned=self.stats["files_scanned"],
             files_indexed=self.stats["files_indexed"],
             files_skipped=self.stats["files_skipped"],
+            files_deleted=self.stats["files_deleted"],
             errors=self.stats["errors"],
             files_per_sec=(
                 round(self.stats["files_scanned"] / elapsed, 2) if elapsed > 0 else 0
@@ -402,9 +639,8 @@ def main():
 
     logger.info("indexer_starting", config=config.__dict__)
 
-    indexer = FileIndexer(config)
-
     try:
+        indexer = FileIndexer(config)
         indexer.run()
     except KeyboardInterrupt:
         logger.info("indexer_interrupted")
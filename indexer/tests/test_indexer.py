@@ -1,12 +1,16 @@
 """Unit tests for the filesystem indexer."""
 
 import os
+import socket
 import sys
 import tempfile
+import threading
 import time
 from unittest.mock import Mock, patch, MagicMock
 
+import orjson
 import pytest
+import requests
 from faker import Faker
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -86,6 +90,54 @@ class TestFileIndexer:
         finally:
             os.unlink(excludes_file)
 
+    def test_load_excludes_missing_file(self, config):
+        """Test that a missing exclusion file yields no patterns."""
+        config.excludes_file = "/nonexistent/excludes.txt"
+        indexer = FileIndexer(config)
+
+        assert indexer.excludes == []
+        assert not indexer._is_excluded("any/file.txt")
+
+    @pytest.mark.parametrize("root_name", ['a"b', "a\\", "a\\b"])
+    def test_root_name_filter_characters_rejected(self, config, root_name):
+        """Test that root names that would break the sweep filter are refused."""
+        config.root_name = root_name
+        with pytest.raises(ValueError):
+            FileIndexer(config)
+
+    def test_client_retries_stale_connections(self, config):
+        """Test that a connection dropped by the server is retried once."""
+        connections = []
+
+        def serve(server):
+            # The first connection is closed without a response, like a
+            # keep-alive socket the server has timed out; the second answers
+            for _ in range(2):
+                conn, _ = server.accept()
+                connections.append(conn)
+                conn.recv(65536)
+                if len(connections) == 2:
+                    body = b'{"estimatedTotalHits": 7}'
+                    conn.sendall(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                    )
+                conn.close()
+
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            thread = threading.Thread(target=serve, args=(server,), daemon=True)
+            thread.start()
+            config.meilisearch_url = "http://127.0.0.1:%d" % server.getsockname()[1]
+            indexer = FileIndexer(config)
+
+            response = indexer.client.session.post(
+                indexer.client.search_url, data=b"{}", timeout=5
+            )
+            thread.join(timeout=5)
+
+        assert response.json() == {"estimatedTotalHits": 7}
+        assert len(connections) == 2
+
     @patch("requests.Session.post")
     def test_add_documents(self, mock_post, indexer):
         """Test adding documents to Meilisearch."""
@@ -135,7 +187,7 @@ class TestFileIndexer:
         assert args[0] == f"{indexer.config.meilisearch_url}/indexes/files/documents"
 
         # Verify the documents were passed
-        assert kwargs["json"] == documents
+        assert orjson.loads(kwargs["data"]) == documents
         assert task_uid == 123
 
     @patch("requests.Session.post")
@@ -160,38 +212,80 @@ class TestFileIndexer:
         )
 
         # Verify the filter was passed
-        assert kwargs["json"] == {"filter": filter_str}
+        assert orjson.loads(kwargs["data"]) == {"filter": filter_str}
         assert task_uid == 456
 
     @patch("requests.Session.post")
     def test_sweep_deletions(self, mock_post, indexer):
         """Test deletion sweep."""
+        # Mock the stale-document count response
+        mock_count_response = Mock()
+        mock_count_response.status_code = 200
+        mock_count_response.json.return_value = {"estimatedTotalHits": 5}
+        mock_count_response.raise_for_status = Mock()
+
         # Mock the delete response
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = {"taskUid": 789}
         mock_response.raise_for_status = Mock()
 
-        # Mock the task status check
+        # Mock the task status check; the task reports the actual deletions,
+        # which may differ from the estimated count
         mock_get_response = Mock()
         mock_get_response.status_code = 200
-        mock_get_response.json.return_value = {"status": "succeeded"}
+        mock_get_response.json.return_value = {
+            "status": "succeeded",
+            "details": {"deletedDocuments": 4},
+        }
         mock_get_response.raise_for_status = Mock()
 
         with patch("requests.Session.get", return_value=mock_get_response):
-            mock_post.return_value = mock_response
+            mock_post.side_effect = [mock_count_response, mock_response]
 
             scan_id = int(time.time())
             indexer._sweep_deletions(scan_id)
 
-            assert mock_post.called
+            assert mock_post.call_count == 2
             args, kwargs = mock_post.call_args
 
             # Verify the filter format
             expected_filter = (
                 f'root = "{indexer.config.root_name}" AND seen_at < {scan_id}'
             )
-            assert kwargs["json"]["filter"] == expected_filter
+            assert args[0].endswith("/documents/delete")
+            assert orjson.loads(kwargs["data"])["filter"] == expected_filter
+            assert indexer.stats["files_deleted"] == 4
+
+    @patch("requests.Session.post")
+    def test_count_documents_retries_transient_errors(self, mock_post, indexer):
+        """Test that a single failed count does not abort the deletion sweep."""
+        mock_response = Mock()
+        mock_response.raise_for_status = Mock()
+        mock_response.json.return_value = {"estimatedTotalHits": 3}
+        mock_post.side_effect = [requests.ConnectionError("blip"), mock_response]
+
+        # Skip tenacity's backoff so the retry is immediate
+        retrying = type(indexer.client).count_documents.retry
+        with patch.object(retrying, "sleep", lambda seconds: None):
+            assert indexer.client.count_documents("seen_at < 1") == 3
+
+        assert mock_post.call_count == 2
+
+    @patch("requests.Session.post")
+    def test_sweep_deletions_nothing_stale(self, mock_post, indexer):
+        """Test that no delete task is enqueued when nothing is stale."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"hits": [], "estimatedTotalHits": 0}
+        mock_response.raise_for_status = Mock()
+        mock_post.return_value = mock_response
+
+        indexer._sweep_deletions(int(time.time()))
+
+        assert mock_post.call_count == 1
+        assert mock_post.call_args[0][0].endswith("/indexes/files/search")
+        assert indexer.stats["files_deleted"] == 0
 
     def test_scan_directory(self, indexer):
         """Test directory scanning."""
@@ -379,6 +473,18 @@ class TestFileIndexer:
         assert not indexer._is_excluded("src/main.py")
         assert not indexer._is_excluded("project/src/index.js")
 
+    def test_exclude_double_star_patterns(self, indexer):
+        """Test that ** globs also match at the root and the directory itself."""
+        indexer.excludes = ["**/.git/**", "docs/**/draft.md"]
+
+        assert indexer._is_excluded(".git/config")
+        assert indexer._is_excluded("project/.git/")
+        assert not indexer._is_excluded("project/.git")
+        assert indexer._is_excluded("docs/draft.md")
+        assert indexer._is_excluded("docs/a/b/draft.md")
+        assert not indexer._is_excluded("project/.github/workflows/ci.yml")
+        assert not indexer._is_excluded("notes/draft.md")
+
     @patch("requests.Session.get")
     def test_get_stats(self, mock_get, indexer):
         """Test getting index statistics."""
@@ -458,3 +564,117 @@ class TestFileIndexer:
             # Should only find the good file
             assert len(results) == 1
             assert results[0]["basename"] == "good.txt"
+
+    def test_scan_directory_scan_threads(self, config):
+        """Test that a configured scan pool size still walks the whole tree."""
+        config.scan_threads = 1
+        indexer = FileIndexer(config)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            current = tmpdir
+            for depth in range(4):
+                current = os.path.join(current, f"level{depth}")
+                os.mkdir(current)
+                for i in range(3):
+                    filepath = os.path.join(current, f"file{i}.txt")
+                    with open(filepath, "w") as f:
+                        f.write("content")
+                    os.utime(filepath, (time.time() - 100, time.time() - 100))
+
+            results = list(indexer._scan_directory(tmpdir, int(time.time())))
+
+            assert len(results) == 12
+            assert indexer.stats["files_scanned"] == 12
+
+    def test_excluded_directory_not_listed(self, indexer):
+        """Test that excluded directories are pruned before being listed."""
+        indexer.excludes = ["skip"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            skip_dir = os.path.join(tmpdir, "skip")
+            os.mkdir(skip_dir)
+            for path in (
+                os.path.join(tmpdir, "good.txt"),
+                os.path.join(skip_dir, "bad.txt"),
+            ):
+                with open(path, "w") as f:
+                    f.write("content")
+                os.utime(path, (time.time() - 100, time.time() - 100))
+
+            with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+                results = list(indexer._scan_directory(tmpdir, int(time.time())))
+
+            assert [r["basename"] for r in results] == ["good.txt"]
+            listed = [call.args[0] for call in mock_scandir.call_args_list]
+            assert skip_dir not in listed
+
+    def test_file_named_like_excluded_directory_indexed(self, indexer):
+        """Test that "build/**" prunes a build/ directory but keeps a build file."""
+        indexer.excludes = ["**/build/**"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            build_dir = os.path.join(tmpdir, "build")
+            proj_dir = os.path.join(tmpdir, "proj")
+            os.mkdir(build_dir)
+            os.mkdir(proj_dir)
+            for path in (
+                os.path.join(build_dir, "output.js"),
+                os.path.join(proj_dir, "build"),
+            ):
+                with open(path, "w") as f:
+                    f.write("content")
+                os.utime(path, (time.time() - 100, time.time() - 100))
+
+            with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+                results = list(indexer._scan_directory(tmpdir, int(time.time())))
+
+            assert [r["basename"] for r in results] == ["build"]
+            listed = [call.args[0] for call in mock_scandir.call_args_list]
+            assert build_dir not in listed
+
+    def test_run_uploads_batches_in_background(self, config):
+        """Test that run() hands every scanned batch to the upload workers."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for i in range(5):
+                filepath = os.path.join(tmpdir, f"file{i}.txt")
+                with open(filepath, "w") as f:
+                    f.write("content")
+                os.utime(filepath, (time.time() - 100, time.time() - 100))
+
+            config.scan_roots = [tmpdir]
+            config.batch_size = 2
+            indexer = FileIndexer(config)
+            indexer.client = MagicMock()
+            indexer.client.add_documents.side_effect = range(100, 200)
+            indexer.client.wait_for_task.return_value = True
+            indexer.client.count_documents.return_value = 0
+            indexer.client.get_stats.return_value = {}
+
+            indexer.run()
+
+            uploaded = [
+                doc["basename"]
+                for call in indexer.client.add_documents.call_args_list
+                for doc in call.args[0]
+            ]
+            assert sorted(uploaded) == [f"file{i}.txt" for i in range(5)]
+            assert indexer.client.add_documents.call_count == 3
+            assert indexer.stats["files_indexed"] == 5
+
+    def test_invalidate_api_cache_sends_no_meilisearch_auth(self, config):
+        """Test that the search API is never sent the Meilisearch master key."""
+        config.search_api_url = "http://search-api:8080"
+        config.invalidate_token = "secret"
+        indexer = FileIndexer(config)
+
+        mock_response = Mock()
+        mock_response.raise_for_status = Mock()
+
+        with patch("requests.Session.send", return_value=mock_response) as mock_send:
+            indexer._invalidate_api_cache()
+
+        assert mock_send.call_count == 1
+        request = mock_send.call_args.args[0]
+        assert request.url == "http://search-api:8080/internal/invalidate"
+        assert "Authorization" not in request.headers
+        assert request.headers["X-Invalidate-Token"] == "secret"
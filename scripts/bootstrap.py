@@ -4,14 +4,17 @@
 Adds structured JSON logging so CI/e2e runs can clearly surface the failing phase.
 """
 
+import http.client
+import io
 import json
 import os
+import random
 import sys
 import time
 import urllib.error
 import urllib.parse
-import urllib.request
-from typing import Any, Dict
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
 
 # ---------------------------------------------------------------------------
 # Logging helpers (single-line JSON to simplify parsing / debugging)
@@ -44,32 +47,147 @@ def error(msg: str, **fields: Any) -> None:
     _log("error", msg, **fields)
 
 
+# ---------------------------------------------------------------------------
+# Index settings (fixed, so encoded once at import)
+# ---------------------------------------------------------------------------
+SETTINGS: Dict[str, Any] = {
+    "searchableAttributes": ["basename", "path"],
+    "filterableAttributes": [
+        "root",
+        "ext",
+        "dirpath",
+        "size",
+        "mtime",
+        "uid",
+        "gid",
+        "mode",
+        "seen_at",
+    ],
+    "sortableAttributes": ["basename", "path", "size", "mtime", "seen_at"],
+    "displayedAttributes": [
+        "id",
+        "root",
+        "path",
+        "basename",
+        "ext",
+        "dirpath",
+        "size",
+        "mtime",
+        "uid",
+        "gid",
+        "mode",
+    ],
+    "rankingRules": [
+        "words",
+        "typo",
+        "proximity",
+        "attribute",
+        "sort",
+        "exactness",
+    ],
+    "typoTolerance": {
+        "enabled": True,
+        "minWordSizeForTypos": {"oneTypo": 4, "twoTypos": 8},
+    },
+    "pagination": {"maxTotalHits": 100000},
+}
+SETTINGS_BODY = json.dumps(SETTINGS).encode("utf-8")
+CREATE_INDEX_BODY = json.dumps({"uid": "files", "primaryKey": "id"}).encode("utf-8")
+
+
 # ---------------------------------------------------------------------------
 # HTTP utilities
 # ---------------------------------------------------------------------------
+# The master key does not change during a run; build the headers once
+MASTER_KEY = os.environ.get("MEILI_MASTER_KEY")
+AUTH_HEADERS = {"Authorization": f"Bearer {MASTER_KEY}"} if MASTER_KEY else {}
+DEFAULT_HEADERS = {"Content-Type": "application/json", **AUTH_HEADERS}
+
+# One keep-alive connection per (scheme, host) so the readiness probes and task
+# polls reuse a single socket instead of reconnecting for every request
+_connections: Dict[Tuple[str, str], http.client.HTTPConnection] = {}
+
+
+def _get_connection(scheme: str, netloc: str) -> http.client.HTTPConnection:
+    conn = _connections.get((scheme, netloc))
+    if conn is None:
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=30)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=30)
+        _connections[(scheme, netloc)] = conn
+    return conn
+
+
+@lru_cache(maxsize=64)
+def _split_url(url: str) -> Tuple[str, str, str]:
+    """Split a URL into (scheme, netloc, request target); polled URLs repeat."""
+    parts = urllib.parse.urlsplit(url)
+    target = parts.path or "/"
+    if parts.query:
+        target = f"{target}?{parts.query}"
+    return parts.scheme, parts.netloc, target
+
+
+def _send(
+    url: str, method: str, body: bytes | None, headers: dict
+) -> Tuple[int, str, http.client.HTTPMessage, bytes]:
+    scheme, netloc, target = _split_url(url)
+    conn = _get_connection(scheme, netloc)
+    # An idle keep-alive socket may have been closed by the server; that only
+    # shows up on the next request, so retry once on a fresh connection
+    retry_stale = conn.sock is not None
+    while True:
+        try:
+            conn.request(method, target, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.reason, response.headers, response.read()
+        except (
+            http.client.RemoteDisconnected,
+            ConnectionResetError,
+            BrokenPipeError,
+        ):
+            conn.close()
+            if not retry_stale:
+                raise
+            retry_stale = False
+            debug("connection_reset_retry", url=url)
+        except Exception:
+            conn.close()
+            raise
+
+
 def make_request(
-    url: str, method: str = "GET", data: dict | None = None, headers: dict | None = None
+    url: str, method: str = "GET", data: Any = None, headers: dict | None = None
 ) -> dict:
     if headers is None:
-        headers = {"Content-Type": "application/json"}
+        headers = DEFAULT_HEADERS
+    else:
+        headers = {**headers, **AUTH_HEADERS}
 
-    master_key = os.environ.get("MEILI_MASTER_KEY")
-    if master_key:
-        headers["Authorization"] = f"Bearer {master_key}"
-
-    req_data = json.dumps(data).encode("utf-8") if data is not None else None
-    req = urllib.request.Request(url, data=req_data, headers=headers, method=method)
+    # Pre-encoded bodies are sent as-is
+    if data is None or isinstance(data, bytes):
+        req_data = data
+    else:
+        req_data = json.dumps(data).encode("utf-8")
 
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            if response.status == 204:
-                return {}
-            body = response.read().decode("utf-8")
-            try:
-                return json.loads(body)
-            except json.JSONDecodeError:
-                error("json_decode_error", url=url, body_preview=body[:200])
-                raise
+        status, reason, resp_headers, raw = _send(url, method, req_data, headers)
+        if status >= 400:
+            # Surface errors the same way urlopen did so callers can inspect
+            # e.code / e.read()
+            raise urllib.error.HTTPError(
+                url, status, reason, resp_headers, io.BytesIO(raw)
+            )
+        if status == 204:
+            return {}
+        try:
+            # json.loads detects UTF-8 in bytes itself; no intermediate str
+            return json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            preview = raw[:200].decode("utf-8", errors="replace")
+            error("json_decode_error", url=url, body_preview=preview)
+            raise
     except urllib.error.HTTPError as e:
         err_body = e.read().decode("utf-8", errors="replace")
         error(
@@ -88,7 +206,29 @@ def make_request(
 # ---------------------------------------------------------------------------
 # Lifecycle helpers
 # ---------------------------------------------------------------------------
-def wait_for_meilisearch(base_url: str, retries: int = 30) -> bool:
+def _backoff(
+    attempt: int, base: float = 0.1, cap: float = 2.0, jitter: float = 0.0
+) -> float:
+    """Exponential delay, optionally stretched by up to `jitter` (a fraction)."""
+    return min(cap, base * 2**attempt) * (1 + random.random() * jitter)
+
+
+def _is_permanent(exc: Exception) -> bool:
+    """Client errors such as 401/403/404 will not go away by retrying."""
+    return (
+        isinstance(exc, urllib.error.HTTPError)
+        and 400 <= exc.code < 500
+        and exc.code not in (408, 429)
+    )
+
+
+def wait_for_meilisearch(base_url: str, retries: int = 23) -> bool:
+    """Probe /health until Meilisearch is available.
+
+    Sleeps between probes go 0.25s, 0.5s, 1s, then 2s, each stretched by up
+    to 50% jitter. With the default 23 probes that totals at most ~60s of
+    sleep (~50s on average), plus the time the probes themselves take.
+    """
     info("waiting_for_meilisearch", base_url=base_url, retries=retries)
     for attempt in range(1, retries + 1):
         try:
@@ -97,128 +237,145 @@ def wait_for_meilisearch(base_url: str, retries: int = 30) -> bool:
                 info("meilisearch_ready")
                 return True
         except Exception as e:  # noqa: BLE001
+            if _is_permanent(e):
+                error("meilisearch_probe_rejected", code=e.code, reason=e.reason)
+                return False
             debug("meilisearch_not_ready", attempt=attempt, error=str(e))
-        time.sleep(2)
+        if attempt == retries:
+            break
+        # Start probing quickly since the server is often up within a second;
+        # jitter keeps several waiting clients from probing in lockstep
+        time.sleep(_backoff(attempt - 1, base=0.25, cap=2.0, jitter=0.5))
     return False
 
 
-def wait_for_task(base_url: str, task_uid: int, timeout: int = 120) -> bool:
+def wait_for_tasks(base_url: str, task_uids: List[int], timeout: int = 120) -> bool:
+    """Poll several tasks with one /tasks request per round until all finish."""
+    pending = set(task_uids)
     start = time.time()
-    debug("wait_for_task_start", task_uid=task_uid, timeout=timeout)
+    debug("wait_for_tasks_start", task_uids=sorted(pending), timeout=timeout)
+    attempt = 0
+    url: str | None = None
     while time.time() - start < timeout:
+        # The poll URL only changes when a task finishes
+        if url is None:
+            uids = ",".join(str(uid) for uid in sorted(pending))
+            url = f"{base_url}/tasks?uids={uids}&limit={len(pending)}"
         try:
-            task = make_request(f"{base_url}/tasks/{task_uid}")
-            status = task.get("status")
-            if status == "succeeded":
-                debug("task_succeeded", task_uid=task_uid)
+            resp = make_request(url)
+            for task in resp.get("results", []):
+                task_uid = task.get("uid")
+                status = task.get("status")
+                if status == "succeeded":
+                    debug("task_succeeded", task_uid=task_uid)
+                    pending.discard(task_uid)
+                    url = None
+                elif status in ("failed", "canceled"):
+                    err = task.get("error") or {}
+                    # Accept index_already_exists as success for idempotency
+                    if (
+                        isinstance(err, dict)
+                        and err.get("code") == "index_already_exists"
+                    ):
+                        warn("task_failed_index_exists", task_uid=task_uid)
+                        pending.discard(task_uid)
+                        url = None
+                        continue
+                    error("task_failed", task_uid=task_uid, status=status, error=err)
+                    return False
+            if not pending:
                 return True
-            if status == "failed":
-                err = task.get("error") or {}
-                # Accept index_already_exists as success for idempotency
-                if isinstance(err, dict) and err.get("code") == "index_already_exists":
-                    warn("task_failed_index_exists", task_uid=task_uid)
-                    return True
-                error("task_failed", task_uid=task_uid, error=err)
-                return False
         except Exception as e:  # noqa: BLE001
-            warn("task_poll_error", task_uid=task_uid, error=str(e))
-        time.sleep(0.5)
-    error("task_timeout", task_uid=task_uid, timeout=timeout)
+            if _is_permanent(e):
+                error("task_poll_rejected", code=e.code, reason=e.reason)
+                return False
+            warn("task_poll_error", task_uids=sorted(pending), error=str(e))
+        # Most bootstrap tasks finish in well under a second; start polling
+        # fast and back off for the slow ones
+        time.sleep(_backoff(attempt))
+        attempt += 1
+    error("task_timeout", task_uids=sorted(pending), timeout=timeout)
     return False
 
 
-def create_index(base_url: str) -> bool:
+def wait_for_task(base_url: str, task_uid: int, timeout: int = 120) -> bool:
+    return wait_for_tasks(base_url, [task_uid], timeout)
+
+
+def create_index(base_url: str) -> List[int] | None:
+    """Enqueue creation of the files index.
+
+    Returns the task uids to wait for (empty if the index already exists),
+    or None on failure.
+    """
     info("create_index_start")
     try:
         # Fast path: already exists
         try:
             make_request(f"{base_url}/indexes/files")
             info("index_already_exists")
-            return True
+            return []
         except urllib.error.HTTPError as e:
             if e.code != 404:
                 raise
         resp = make_request(
-            f"{base_url}/indexes",
-            method="POST",
-            data={"uid": "files", "primaryKey": "id"},
+            f"{base_url}/indexes", method="POST", data=CREATE_INDEX_BODY
         )
         task_uid = resp.get("taskUid")
         if task_uid is None:
             warn("index_create_missing_task_uid", raw=resp)
-            return False
-        if wait_for_task(base_url, int(task_uid)):
-            info("index_create_ok", task_uid=task_uid)
-            return True
-        warn("index_create_task_failed", task_uid=task_uid)
+            return None
+        info("index_create_enqueued", task_uid=task_uid)
+        return [int(task_uid)]
     except urllib.error.HTTPError as e:
         if e.code == 409:
             info("index_conflict_already_exists")
-            return True
+            return []
         error("index_create_http_error", code=e.code, reason=e.reason)
     except Exception as e:  # noqa: BLE001
         error("index_create_exception", error=str(e))
-    return False
+    return None
 
 
-def configure_index(base_url: str) -> bool:
+def configure_index(base_url: str) -> List[int] | None:
+    """Enqueue the settings update; returns its task uid or None on failure."""
     info("configure_index_start")
-    settings = {
-        "searchableAttributes": ["basename", "path"],
-        "filterableAttributes": [
-            "root",
-            "ext",
-            "dirpath",
-            "size",
-            "mtime",
-            "uid",
-            "gid",
-            "mode",
-            "seen_at",
-        ],
-        "sortableAttributes": ["basename", "path", "size", "mtime", "seen_at"],
-        "displayedAttributes": [
-            "id",
-            "root",
-            "path",
-            "basename",
-            "ext",
-            "dirpath",
-            "size",
-            "mtime",
-            "uid",
-            "gid",
-            "mode",
-        ],
-        "rankingRules": [
-            "words",
-            "typo",
-            "proximity",
-            "attribute",
-            "sort",
-            "exactness",
-        ],
-        "typoTolerance": {
-            "enabled": True,
-            "minWordSizeForTypos": {"oneTypo": 4, "twoTypos": 8},
-        },
-        "pagination": {"maxTotalHits": 100000},
-    }
     try:
         resp = make_request(
-            f"{base_url}/indexes/files/settings", method="PATCH", data=settings
+            f"{base_url}/indexes/files/settings", method="PATCH", data=SETTINGS_BODY
         )
         task_uid = resp.get("taskUid")
         if task_uid is None:
             warn("settings_missing_task_uid", raw=resp)
-            return False
-        if wait_for_task(base_url, int(task_uid), timeout=180):
-            info("configure_index_ok", task_uid=task_uid)
-            return True
-        warn("configure_index_task_failed", task_uid=task_uid)
+            return None
+        info("configure_index_enqueued", task_uid=task_uid)
+        return [int(task_uid)]
     except Exception as e:  # noqa: BLE001
         error("configure_index_exception", error=str(e))
-    return False
+    return None
+
+
+def setup_index(base_url: str) -> bool:
+    """Create and configure the index, waiting on both tasks together.
+
+    Meilisearch runs tasks in enqueue order, so the settings update can be
+    submitted before the creation task has finished.
+    """
+    create_tasks = create_index(base_url)
+    if create_tasks is None:
+        error("create_index_failed")
+        return False
+    settings_tasks = configure_index(base_url)
+    if settings_tasks is None:
+        error("configure_index_failed")
+        return False
+
+    task_uids = create_tasks + settings_tasks
+    if not wait_for_tasks(base_url, task_uids, timeout=180):
+        error("setup_index_tasks_failed", task_uids=task_uids)
+        return False
+    info("setup_index_ok", task_uids=task_uids)
+    return True
 
 
 def test_index(base_url: str) -> bool:
@@ -245,18 +402,22 @@ def test_index(base_url: str) -> bool:
         if task_uid is None or not wait_for_task(base_url, int(task_uid)):
             warn("test_index_add_failed", task_uid=task_uid)
             return False
-        time.sleep(1)
+        # A succeeded task means the document is already searchable
+        # Only whether anything matched matters; keep the response minimal
         search = make_request(
-            f"{base_url}/indexes/files/search", method="POST", data={"q": "bootstrap"}
+            f"{base_url}/indexes/files/search",
+            method="POST",
+            data={"q": "bootstrap", "limit": 1, "attributesToRetrieve": ["id"]},
         )
         hits = search.get("hits", [])
         if hits:
             info("test_index_search_ok", hits=len(hits))
-            # cleanup
+            # cleanup; nothing depends on the outcome, and Meilisearch runs the
+            # delete ahead of any later indexer task, so don't wait for it
             del_resp = make_request(
                 f"{base_url}/indexes/files/documents/1", method="DELETE"
             )
-            wait_for_task(base_url, del_resp.get("taskUid", 0))
+            debug("test_index_cleanup_enqueued", task_uid=del_resp.get("taskUid"))
             return True
         warn("test_index_search_no_hits")
     except Exception as e:  # noqa: BLE001
@@ -269,18 +430,14 @@ def main() -> None:
     info(
         "bootstrap_start",
         base_url=base_url,
-        master_key_present=bool(os.environ.get("MEILI_MASTER_KEY")),
+        master_key_present=bool(MASTER_KEY),
         verbose=VERBOSE,
     )
     try:
         if not wait_for_meilisearch(base_url):
             error("meilisearch_unavailable")
             sys.exit(1)
-        if not create_index(base_url):
-            error("create_index_failed")
-            sys.exit(1)
-        if not configure_index(base_url):
-            error("configure_index_failed")
+        if not setup_index(base_url):
             sys.exit(1)
         if not test_index(base_url):
             warn("test_index_failed_continuing")
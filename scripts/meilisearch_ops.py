@@ -2,6 +2,13 @@
 """
 Meilisearch operations helper script.
 Useful commands for managing the Meilisearch index.
+
+Run it from the repository root as `python scripts/meilisearch_ops.py <command>`
+(or from any directory as long as the script's own path is used): it imports
+the index settings from scripts/bootstrap.py, which must be importable next to
+it.
+
+`reset` applies bootstrap's SETTINGS.
 """
 
 import argparse
@@ -13,6 +20,8 @@ from typing import Dict, Any
 
 import requests
 
+from bootstrap import SETTINGS
+
 
 class MeilisearchOps:
     """Helper class for Meilisearch operations."""
@@ -130,35 +139,9 @@ class MeilisearchOps:
             if not self._wait_for_task(task_uid):
                 return False
 
-        # Configure settings
-        settings = {
-            "searchableAttributes": ["basename", "path"],
-            "filterableAttributes": [
-                "root",
-                "ext",
-                "dirpath",
-                "size",
-                "mtime",
-                "uid",
-                "gid",
-                "mode",
-                "seen_at",
-            ],
-            "sortableAttributes": ["basename", "path", "size", "mtime"],
-            "rankingRules": [
-                "words",
-                "typo",
-                "proximity",
-                "attribute",
-                "sort",
-                "exactness",
-            ],
-            "typoTolerance": {
-                "enabled": True,
-                "minWordSizeForTypos": {"oneTypo": 4, "twoTypos": 8},
-            },
-        }
-        return self.update_settings(settings)
+        # Configure settings; shared with bootstrap so a reset index is
+        # configured exactly like a freshly bootstrapped one
+        return self.update_settings(SETTINGS)
 
     def export_documents(self, limit: int = 1000, offset: int = 0) -> list:
         """Export documents from the index."""
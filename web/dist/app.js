@@ -165,8 +165,8 @@ function displayResults(data) {
             <div class="result-meta">
                 <span>📄 ${escapeHtml(file.basename)}</span>
                 <span>📁 ${escapeHtml(file.dirpath)}</span>
-                <span>💾 ${file.size_formatted}</span>
-                <span>📅 ${file.mtime_formatted}</span>
+                <span>💾 ${formatSize(file.size)}</span>
+                <span>📅 ${formatDate(new Date(file.mtime * 1000))}</span>
                 <button class="copy-btn" onclick="copyPath('${escapeHtml(file.path)}', this)">
                     📋 Copy
                 </button>
@@ -228,6 +228,17 @@ function formatNumber(num) {
     return new Intl.NumberFormat().format(num);
 }
 
+function formatSize(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB', 'TB', 'PB'];
+    let size = bytes;
+    let unit = 0;
+    while (size >= 1024 && unit < units.length - 1) {
+        size /= 1024;
+        unit++;
+    }
+    return `${size.toFixed(1)} ${units[unit]}`;
+}
+
 function formatDate(date) {
     return new Intl.DateTimeFormat('en-US', {
         dateStyle: 'short',